@@ -1,5 +1,85 @@
+import argparse
+import dataclasses
 import json
+import sys
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress, count
+from operator import ne
+from typing import Any, Iterable, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+# Number of items above which a list is written to its json file one item at a time
+STREAM_ITEMS_THRESHOLD = 1000
+
+# Bucket of changes_dict for each list of actions Terraform reports on a change
+ACTION_BUCKETS = {
+    ("create",): "create",
+    ("delete",): "delete",
+    ("update",): "update",
+    ("create", "delete"): "create_and_delete",
+    ("delete", "create"): "create_and_delete",
+    ("replace",): "replace",
+    ("no-op",): "no_op",
+}
+
+# Summary counters incremented for each bucket of changes_dict
+BUCKET_SUMMARY_KEYS = {
+    "create": ("create",),
+    "delete": ("delete",),
+    "update": ("update",),
+    "create_and_delete": ("create", "delete"),
+    "replace": ("replace",),
+    "no_op": ("no_op",),
+}
+
+
+def json_loads(data):
+    """
+    Parse JSON, using orjson when it is installed and the standard library otherwise.
+    :param data: JSON document as bytes
+    :return: Parsed Python object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_default(value):
+    """
+    Serialize the objects the standard json module does not support, orjson handles them natively.
+    :param value: Object to serialize
+    :return: JSON serializable object
+    """
+    if dataclasses.is_dataclass(value):
+        return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_dumps(value):
+    """
+    Serialize a value to compact JSON bytes, using orjson when it is installed.
+    :param value: JSON serializable object
+    :return: JSON document as bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=json_default).encode("utf-8")
+
+
+def json_dumps_pretty(value):
+    """
+    Serialize a value to indented JSON text for display in Terminal.
+    :param value: JSON serializable object
+    :return: Indented JSON string
+    """
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(value, indent=2, default=json_default)
 
 
 def load_terraform_plan(file_path):
@@ -8,62 +88,80 @@ def load_terraform_plan(file_path):
     :param file_path: Terraform plan JSON file
     :return: Dictionary of Terraform plan objects
     """
-    with open(file_path, 'r') as file:
-        return json.load(file)
+    with open(file_path, 'rb') as file:
+        return json_loads(file.read())
 
 
-def change_details(change, action):
+@dataclasses.dataclass(slots=True)
+class Resource:
+    """
+    The change details of a resource of a terraform plan, serialized to json in the order of its fields.
+    """
+    resource_address: str
+    module_address: str
+    name: Optional[str]
+    type: Optional[str]
+    actions: list
+    before: Any
+    after: Any
+    dependencies: Any
+    differences: Optional[dict]
+
+
+def change_details(change: dict, action: Sequence[str]) -> Resource:
     """
     The change details of a terraform plan.
     :param change: Change object
     :param action: The type of action {"create", "delete", "update", "replace", "no-op"}
-    :return: Restructured object for analysis
+    :return: Restructured Resource object for analysis
     """
     control_actions = ["create", "delete", "update", "replace"]
     resource_address = change.get("address", "")
     module_address = change.get("module_address", "")
     resource_name = change.get("name")
     resource_type = change.get("type")
-    resource_actions = change.get("change", {}).get("actions", [])
+    if isinstance(resource_type, str):
+        # Resource types repeat across the plan, share a single string object for each of them
+        resource_type = sys.intern(resource_type)
+    resource_change = change.get("change") or {}
+    resource_actions = resource_change.get("actions", [])
     if action[0] in control_actions:
-        resource_before = change.get("change", {}).get("before", {})
-        resource_after = change.get("change", {}).get("after", {})
-        resource = {
-            "resource_address": resource_address,
-            "module_address": module_address,
-            "name": resource_name,
-            "type": resource_type,
-            "actions": resource_actions,
-            "before": resource_before if resource_before else {},
-            "after": resource_after if resource_after else {},
-            "dependencies": change.get("change", {}).get("dependencies", {}),
-            "differences": get_the_differences(resource_before, resource_after)
-        }
+        resource_before = resource_change.get("before", {})
+        resource_after = resource_change.get("after", {})
+        resource = Resource(
+            resource_address=resource_address,
+            module_address=module_address,
+            name=resource_name,
+            type=resource_type,
+            actions=resource_actions,
+            before=resource_before if resource_before else {},
+            after=resource_after if resource_after else {},
+            dependencies=resource_change.get("dependencies", {}),
+            differences=get_the_differences(resource_before, resource_after)
+        )
     else:
-        resource = {
-            "resource_address": resource_address,
-            "module_address": module_address,
-            "name": resource_name,
-            "type": resource_type,
-            "actions": resource_actions,
-            "before": {},
-            "after": {},
-            "dependencies": change.get("change", {}).get("dependencies", {}),
-            "differences": {}
-        }
+        resource = Resource(
+            resource_address=resource_address,
+            module_address=module_address,
+            name=resource_name,
+            type=resource_type,
+            actions=resource_actions,
+            before={},
+            after={},
+            dependencies=resource_change.get("dependencies", {}),
+            differences={}
+        )
     return resource
 
 
-def analyse_plan(plan, type_of_change):
+def analyse_plan(changes: Iterable[dict]) -> Optional[tuple[dict, dict, dict, dict]]:
     """
     Analyse the Terraform plan and retrieve detailed resource information, and summary of totals.
-    :param plan: Terraform plan Dictionary
-    :param type_of_change: type of change to extract data from ["resource_drift", "resource_changes"]
+    :param changes: Iterable of change objects of one section of the Terraform plan
     :return: Tuple of changes_dict containing key for change types and related changes,
-             and summary of all changes related to section taken from the Terraform Plan Dictionary
+             and summary of all changes related to section taken from the Terraform Plan Dictionary,
+             or None when the section has no changes
     """
-    changes = plan.get(type_of_change, [])
-
     summary = {
         "create": 0,
         "update": 0,
@@ -72,7 +170,7 @@ def analyse_plan(plan, type_of_change):
         "no_op": 0,
     }
 
-    changes_dict = {
+    changes_dict: dict[str, list] = {
         "create_and_delete": [],
         "create": [],
         "update": [],
@@ -81,59 +179,40 @@ def analyse_plan(plan, type_of_change):
         "no_op": [],
     }
 
-    if not changes:
-        return None  # No changes detected
-
-    resource_modules = {}
+    resource_modules: dict[Any, list] = {}
 
-    module_resources = {}
+    module_resources: dict[Any, list] = {}
+    has_changes = False
     for change in changes:
-        action = change.get("change", {}).get("actions", [])
-        if "create" in action:
-            summary["create"] += 1
-            if "delete" in action:
-                changes_dict["create_and_delete"].append(change_details(change, action))
-            else:
-                changes_dict["create"].append(change_details(change, action))
-        if "update" in action:
-            summary["update"] += 1
-            changes_dict["update"].append(change_details(change, action))
-        if "delete" in action:
-            summary["delete"] += 1
-            if "create" not in action:
-                changes_dict["delete"].append(change_details(change, action))
-        if "replace" in action:
-            summary["replace"] += 1
-            changes_dict["replace"].append(change_details(change, action))
-        if "no-op" in action:
-            summary["no_op"] += 1
-            changes_dict["no_op"].append(change_details(change, action))
-        # Group resources by module
+        has_changes = True
+        action = (change.get("change") or {}).get("actions") or ()
+        bucket = ACTION_BUCKETS.get(tuple(action))
+        if bucket is not None:
+            for summary_key in BUCKET_SUMMARY_KEYS[bucket]:
+                summary[summary_key] += 1
+            changes_dict[bucket].append(change_details(change, action))
 
-        module_address = change.get("module_address", "")
-        resource_address = change.get("address", "")
-        resource_name = change.get("name")
+        # Group resources by module
+        module_address = change.get("module_address")
+        resource_address = change.get("address")
         if resource_address and module_address:
+            resource_name = change.get("name")
             if resource_modules.get(resource_name) is None:
-                resource_modules[resource_name]=[module_address]
+                resource_modules[resource_name] = [module_address]
             else:
                 resource_modules[resource_name].append(module_address)
 
-            if resource_address and module_address:
-                if module_resources.get(module_address) is None:
-                    module_resources[module_address] = [
-                        {
-                            "resource_name": resource_name,
-                            "resource_address": resource_address
-                        }
-                    ]
-                else:
-                    module_resources[module_address].append(
-                        {
-                            "resource_name": resource_name,
-                            "resource_address": resource_address
-                        }
-                    )
+            resource = {
+                "resource_name": resource_name,
+                "resource_address": resource_address
+            }
+            if module_resources.get(module_address) is None:
+                module_resources[module_address] = [resource]
+            else:
+                module_resources[module_address].append(resource)
+
+    if not has_changes:
+        return None  # No changes detected
 
     return changes_dict, summary, resource_modules, module_resources
 
@@ -141,7 +220,7 @@ def analyse_plan(plan, type_of_change):
 def display_detailed_changes(detailed_changes, type_of_change):
     """
     Display the detailed changes of the Terraform plan analysis in Terminal.
-    :param detailed_changes: The classified dictionary of changes coming from analyse_plan(plan, change_type) function
+    :param detailed_changes: The classified dictionary of changes coming from analyse_plan(changes) function
     :param type_of_change:  type of change to extract data from ["resource_drift", "resource_changes"]
     :return: None
     """
@@ -153,30 +232,34 @@ def display_detailed_changes(detailed_changes, type_of_change):
         else:
             print(f"Detailed Terraform Plan Analysis  for the +++({change_type})+++ section:")
             for change in change_value:
-                resource_name = change.get("name")
-                resource_type = change.get("type")
-                resource_before = change.get('before')
-                resource_after = change.get('after')
-                resource_dependencies = change.get('dependencies')
-                resource_differences = change.get('differences')
-
-                print(f"\nResource Name: {resource_name}")
-                print(f"Resource Type: {resource_type}")
-                print(f"Actions: {', '.join(change['actions'])}")
-                print("Before:")
-                print(json.dumps(resource_before, indent=4))
-                print("After:")
-                print(json.dumps(resource_after, indent=4))
-                print("Dependencies:")
-                print(json.dumps(resource_dependencies, indent=4))
-                print("Differences:")
-                print(json.dumps(resource_differences, indent=4))
+                resource_name = change.name
+                resource_type = change.type
+                resource_before = change.before
+                resource_after = change.after
+                resource_dependencies = change.dependencies
+                resource_differences = change.differences
+
+                # One write per resource instead of one print per line
+                sys.stdout.write("\n".join([
+                    f"\nResource Name: {resource_name}",
+                    f"Resource Type: {resource_type}",
+                    f"Actions: {', '.join(change.actions)}",
+                    "Before:",
+                    json_dumps_pretty(resource_before),
+                    "After:",
+                    json_dumps_pretty(resource_after),
+                    "Dependencies:",
+                    json_dumps_pretty(resource_dependencies),
+                    "Differences:",
+                    json_dumps_pretty(resource_differences),
+                    "",
+                ]))
 
 
 def display_summary(summary, type_of_change):
     """
     Display the summary of the Terraform plan analysis in Terminal.
-    :param summary: The summary of changes coming from analyse_plan(plan, change_type) function
+    :param summary: The summary of changes coming from analyse_plan(changes) function
     :param type_of_change: type of change to extract data from ["resource_drift", "resource_changes"]
     :return: None
     """
@@ -188,80 +271,154 @@ def display_summary(summary, type_of_change):
     print(f"Resources with no operation: {summary['no_op']}")
 
 
-def find_differences(before, after, path=""):
+def join_path(path: Any) -> str:
+    """
+    Build the dotted path of a value from the chain of keys and list indexes leading to it.
+    Keys are joined the way the paths were always built, f"{path}.{key}".strip("."), so leading and trailing
+    dots of a key and empty keys do not show in the path.
+    :param path: Path string of the root, otherwise a (parent path, key or list index) tuple
+    :return: Path string such as "tags.Name" or "ingress[0].cidr_blocks"
+    """
+    segments = []
+    while isinstance(path, tuple):
+        path, segment = path
+        segments.append(segment)
+    segments.reverse()
+    text = path
+    for segment in segments:
+        if isinstance(segment, int):
+            text = f"{text}[{segment}]"
+        else:
+            text = f"{text}.{segment}".strip(".")
+    return text
+
+
+def find_differences(before: Any, after: Any, path: str = "") -> dict:
     """
     Find the differences between the before and after state of a terraform plan changes.
+    The nested values are walked with an explicit stack, so deeply nested states do not hit the recursion limit,
+    and the path of a value is only turned into a string when a difference is recorded for it.
     :param before: Dictionary of before variables values
     :param after: Dictionary of after variables values
     :return: differences Dictionary of changes between before and after whether it was added, removed or updated/changed
     """
-    differences = {
-        "added": {},
-        "removed": {},
-        "changed": {}
-    }
-
-    # Compare dictionaries
-    if isinstance(before, dict) and isinstance(after, dict):
-        before_keys = set(before.keys())
-        after_keys = set(after.keys())
-
-        for key in after_keys - before_keys:
-            differences["added"][f"{path}.{key}".strip(".")] = after[key]
-
-        for key in before_keys - after_keys:
-            differences["removed"][f"{path}.{key}".strip(".")] = before[key]
-
-        for key in before_keys & after_keys:
-            sub_diff = find_differences(before[key], after[key], path=f"{path}.{key}".strip("."))
-            differences["added"].update(sub_diff["added"])
-            differences["removed"].update(sub_diff["removed"])
-            differences["changed"].update(sub_diff["changed"])
-
-    # Compare lists
-    elif isinstance(before, list) and isinstance(after, list):
-        for i, (b_item, a_item) in enumerate(zip(before, after)):
-            sub_diff = find_differences(b_item, a_item, path=f"{path}[{i}]")
-            differences["added"].update(sub_diff["added"])
-            differences["removed"].update(sub_diff["removed"])
-            differences["changed"].update(sub_diff["changed"])
-
-        # Handle added or removed items in lists
-        if len(after) > len(before):
-            for i in range(len(before), len(after)):
-                differences["added"][f"{path}[{i}]".strip(".")] = after[i]
-        elif len(before) > len(after):
-            for i in range(len(after), len(before)):
-                differences["removed"][f"{path}[{i}]".strip(".")] = before[i]
-
-    # Compare values directly
-    else:
-        if before != after:
-            differences["changed"][path] = {
+    added: dict = {}
+    removed: dict = {}
+    changed: dict = {}
+
+    # Equal values are never pushed on the stack, so unchanged subtrees are skipped with one comparison
+    stack: list = []
+    if before is not after and before != after:
+        stack.append((before, after, path))
+    while stack:
+        before, after, parent = stack.pop()
+
+        # Compare dictionaries
+        if isinstance(before, dict) and isinstance(after, dict):
+            for key, after_value in after.items():
+                if key in before:
+                    before_value = before[key]
+                    if before_value is after_value or before_value == after_value:
+                        continue
+                    if isinstance(before_value, (dict, list)) or isinstance(after_value, (dict, list)):
+                        stack.append((before_value, after_value, (parent, key)))
+                    else:
+                        changed[join_path((parent, key))] = {
+                            "before": before_value,
+                            "after": after_value
+                        }
+                else:
+                    added[join_path((parent, key))] = after_value
+
+            for key, before_value in before.items():
+                if key not in after:
+                    removed[join_path((parent, key))] = before_value
+
+        # Compare lists
+        elif isinstance(before, list) and isinstance(after, list):
+            # Indexes of the differing items are found in C by map/compress, without a Python level loop
+            for i in compress(count(), map(ne, before, after)):
+                b_item = before[i]
+                a_item = after[i]
+                if isinstance(b_item, (dict, list)) or isinstance(a_item, (dict, list)):
+                    stack.append((b_item, a_item, (parent, i)))
+                else:
+                    changed[join_path((parent, i))] = {
+                        "before": b_item,
+                        "after": a_item
+                    }
+
+            # Handle added or removed items in lists
+            if len(after) > len(before):
+                for i in range(len(before), len(after)):
+                    added[join_path((parent, i))] = after[i]
+            elif len(before) > len(after):
+                for i in range(len(after), len(before)):
+                    removed[join_path((parent, i))] = before[i]
+
+        # Compare values directly
+        else:
+            changed[join_path(parent)] = {
                 "before": before,
                 "after": after
             }
 
-    return differences
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed
+    }
 
 
-def get_the_differences(before, after):
+def get_the_differences(before: Any, after: Any) -> Optional[dict]:
+    """
+    Get the differences between the before and after state of a terraform plan change, if there are any.
+    :param before: Dictionary of before variables values
+    :param after: Dictionary of after variables values
+    :return: differences Dictionary from find_differences, or None when the states are the same
+    """
+    # Identical states are pruned by the root check of find_differences, which returns empty differences
     differences = find_differences(before, after)
 
     if differences["added"] or differences["removed"] or differences["changed"]:
         return differences
+    return None
+
+
+def write_json_file(file_path, value):
+    """
+    Write a value to a json file.
+    The value is serialized to bytes up front and written in a single call. Lists longer than
+    STREAM_ITEMS_THRESHOLD are serialized one item at a time instead, so that only one serialized item
+    is held in memory next to the objects.
+    :param file_path: Output json file
+    :param value: JSON serializable object
+    :return:
+    """
+    with open(file_path, "wb") as file:
+        if isinstance(value, list) and len(value) > STREAM_ITEMS_THRESHOLD:
+            file.write(b"[")
+            for index, item in enumerate(value):
+                if index:
+                    file.write(b",")
+                file.write(json_dumps(item))
+            file.write(b"]")
+        else:
+            file.write(json_dumps(value))
 
 
 def generate_json_files_for_changes(changes, type_of_change):
     """
     Output all the changes in their relative json files.
-    :param changes: The classified dictionary of changes coming from analyse_plan(plan, change_type) function
+    The files are written from a thread pool, so the writes of the different files overlap.
+    :param changes: The classified dictionary of changes coming from analyse_plan(changes) function
     :param type_of_change: type of change to extract data from ["resource_drift", "resource_changes"]
     :return:
     """
-    for change_type, change_value in changes.items():
-        with open(f"outputs/{change_type}_{type_of_change}.json", "w") as file:
-            json.dump(change_value, file)
+    file_paths = [f"outputs/{change_type}_{type_of_change}.json" for change_type in changes]
+    with ThreadPoolExecutor(max_workers=min(8, len(changes))) as executor:
+        # Consume the results so that a failed write raises here
+        list(executor.map(write_json_file, file_paths, changes.values()))
 
 
 def generate_json_files_for_modules_resources(resource_modules, module_resources):
@@ -272,30 +429,46 @@ def generate_json_files_for_modules_resources(resource_modules, module_resources
     :return:
     """
     if resource_modules:
-        with open(f"outputs/resource_modules.json", "w") as file:
-            json.dump(resource_modules, file)
+        write_json_file("outputs/resource_modules.json", resource_modules)
     if module_resources:
-        with open(f"outputs/module_resources.json", "w") as file:
-            json.dump(module_resources, file)
+        write_json_file("outputs/module_resources.json", module_resources)
+
+
+def parse_arguments():
+    """
+    Parse the command line arguments.
+    :return: Namespace of the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Analyse the Terraform plan JSON file terraform_plan.json")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="display the detailed changes of the plan in Terminal, not only the summary")
+    return parser.parse_args()
+
 
 def main():
+    arguments = parse_arguments()
     change_types = ["resource_drift", "resource_changes"]
     # Path to the Terraform plan JSON file
     file_path = 'terraform_plan.json'
+    # Load the Terraform plan once for all change types
+    plan = load_terraform_plan(file_path)
     for change_type in change_types:
-        # Load the Terraform plan
-        plan = load_terraform_plan(file_path)
-
         # Analyze the plan
-        detailed_changes, summary, resource_modules, module_resources = analyse_plan(plan, change_type)
+        analysis = analyse_plan(plan.get(change_type) or [])
+        if analysis is None:
+            print(f"No changes detected in the Terraform plan for the +++{change_type}+++ section")
+            continue
+        detailed_changes, summary, resource_modules, module_resources = analysis
 
-        # Display the analysis summary
+        # Display the analysis summary, and the detailed changes when asked for
         display_summary(summary, change_type)
-        # display_detailed_changes(detailed_changes, change_type)
+        if arguments.verbose:
+            display_detailed_changes(detailed_changes, change_type)
         generate_json_files_for_changes(detailed_changes, change_type)
 
         # Output the shared resources between modules and the shared modules between resources
         generate_json_files_for_modules_resources(resource_modules, module_resources)
 
+
 if __name__ == "__main__":
     main()